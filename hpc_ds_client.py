@@ -195,9 +195,57 @@ class HPCDatastoreClient(object):
 			ds_regserv.start()
 			self.ds_servers[ds_id] = ds_regserv
 			ds_regserv.client.voxel_type = self.ds_description.voxelType
+			level = self.ds_description.get_resolution_level(resolution)
+			if level is not None:
+				ds_regserv.client.dimensions = \
+					self.ds_description.level_dimensions(resolution)
+				ds_regserv.client.block_dimensions = \
+					Point3D(*level["blockDimensions"])
 
 		return ds_regserv.client
 
+	def read_plane(self, axis, index, time=0, channel=0, angle=0, rect=None,
+					out_size=None, version="latest", timeout=15000):
+		"""Read a 2D plane from the coarsest resolution level which still
+		provides the requested output size
+
+		:type axis: int or str
+		:param axis: Axis perpendicular to the plane, 0/'x' for YZ,
+			1/'y' for XZ and 2/'z' for XY planes
+
+		:type index: int
+		:param index: Position of the plane in full resolution voxels
+
+		:type rect: tuple
+		:param rect: (u, v, width, height) region of the plane in full
+			resolution voxels, None reads the whole plane
+
+		:type out_size: tuple
+		:param out_size: (width, height) the plane is displayed at, None
+			reads the full resolution
+
+		:rtype: numpy.ndarray
+		:return: Array of shape (height, width) at the selected level
+		"""
+		if self.ds_description is None:
+			self.load_description()
+
+		n, u, v = plane_axes(axis)
+		if rect is None:
+			dims = self.ds_description.dimensions
+			rect = (0, 0, dims[u], dims[v])
+		resolution = self.ds_description.select_resolution_level(
+						(u, v), rect[2:], out_size)
+		client = self.start_dataset_server(resolution, DatastoreAccess.READ,
+											version, timeout)
+		# Cover every full resolution voxel of the rect at the level
+		u0, v0 = rect[0] // resolution[u], rect[1] // resolution[v]
+		u1 = -(-(rect[0] + rect[2]) // resolution[u])
+		v1 = -(-(rect[1] + rect[3]) // resolution[v])
+		level_rect = (u0, v0, max(u1 - u0, 1), max(v1 - v0, 1))
+		return client.read_plane(n, index // resolution[n], time, channel,
+									angle, level_rect)
+
 	def __str__(self):
 		out_s = ""
 		for k in self.__dict__:
@@ -74,6 +74,45 @@ class HPCDatastoreDescription(object):
 		else:
 			self.__dict__ = json_objects
 
+	def get_resolution_level(self, resolution):
+		"""Find resolution level entry matching (X,Y,Z) resolution"""
+		for level in self.resolutionLevels:
+			if tuple(level["resolutions"]) == tuple(resolution):
+				return level
+		return None
+
+	def level_dimensions(self, resolution):
+		"""Dataset dimensions downsampled for (X,Y,Z) resolution"""
+		return Point3D(*[max(d // r, 1)
+						 for d, r in zip(self.dimensions, resolution)])
+
+	def select_resolution_level(self, axes, sizes, out_size=None):
+		"""Select the coarsest resolution level still providing the output size
+		:type axes: tuple
+		:param axes: Indices of the two plane axes
+
+		:type sizes: tuple
+		:param sizes: Full resolution sizes of the region on the plane axes
+
+		:type out_size: tuple
+		:param out_size: Requested output size on the plane axes, None
+			selects the finest level
+
+		:rtype: Point3D
+		:return: (X,Y,Z) resolution of the selected level
+		"""
+		levels = sorted((Point3D(*level["resolutions"])
+						 for level in self.resolutionLevels),
+						key=lambda r: r.x * r.y * r.z)
+		selected = levels[0]
+		if out_size is None:
+			return selected
+		for resolution in levels[1:]:
+			if all(s // resolution[a] >= o
+				   for a, s, o in zip(axes, sizes, out_size)):
+				selected = resolution
+		return selected
+
 	@staticmethod
 	def load_json(data):
 		"""Loading of data store description data from JSON to a simple object"""
@@ -3,19 +3,197 @@
 
 from enum import Enum
 from hpc_ds_types import Point3D, Block6D, DatastoreAccess, VOXEL_TYPES, \
-						MAX_URL_LEN
-
-from time import time
+						MAX_URL_LEN, DataStoreAccessException, plane_axes, \
+						adjust_range
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from threading import Lock
+from time import time, monotonic, sleep
 import struct
 
 import requests
 
+class AdaptiveIOController(object):
+	"""AIMD controller of the batch size and of the number of requests in
+	flight used for block I/O.
+
+	Limits used up by a request grow additively while requests succeed.
+	Both limits are halved on errors or when the throughput of a full batch
+	drops spike_factor times below the smoothed throughput. Each decrease
+	starts a new epoch, and requests sent in an earlier epoch neither
+	decrease nor grow the limits again.
+	"""
+
+	def __init__(self, batch_size=None, in_flight=2, max_batch_size=1024,
+					max_in_flight=16, batch_step=4, spike_factor=2.0,
+					smoothing=0.2, max_retries=5, backoff=0.1,
+					max_backoff=10.0, request_timeout=None):
+		"""
+		:type batch_size: int
+		:param batch_size: Initial number of blocks per request, None
+			starts at max_batch_size. The URL length is still limited by
+			MAX_URL_LEN
+
+		:type in_flight: int
+		:param in_flight: Initial number of concurrent requests
+
+		:type batch_step: int
+		:param batch_step: Additive increase of the batch size
+
+		:type spike_factor: float
+		:param spike_factor: Ratio of the smoothed throughput to the
+			throughput of a request treated as overload
+
+		:type smoothing: float
+		:param smoothing: Weight of a new sample in the smoothed values
+
+		:type max_retries: int
+		:param max_retries: Retries of a single block within one read
+
+		:type backoff: float
+		:param backoff: Delay in seconds before retrying after an error,
+			doubled with every consecutive error
+
+		:type max_backoff: float
+		:param max_backoff: Maximum of the doubled delay in seconds,
+			Retry-After of the server is honoured even when longer
+
+		:type request_timeout: float
+		:param request_timeout: Timeout of a single request in seconds,
+			None waits indefinitely
+		"""
+		self.max_batch_size = adjust_range(max_batch_size, 1)
+		self.max_in_flight = adjust_range(max_in_flight, 1)
+		if batch_size is None:
+			batch_size = self.max_batch_size
+		self.batch_size = adjust_range(batch_size, 1, self.max_batch_size)
+		self.in_flight = adjust_range(in_flight, 1, self.max_in_flight)
+		self.batch_step = adjust_range(batch_step, 1)
+		self.spike_factor = spike_factor
+		self.smoothing = smoothing
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.request_timeout = request_timeout
+		self.latency = None
+		self.throughput = None
+		self.errors = 0
+		self.epoch = 0
+		self._consecutive_errors = 0
+		self._successes = 0
+		self._lock = Lock()
+
+	def cap_batch_size(self, batch_size):
+		"""Limit the batch size to the largest batch fitting into an URL"""
+		with self._lock:
+			self.batch_size = max(min(self.batch_size, batch_size), 1)
+
+	def on_success(self, latency, size, batch_full, pipeline_full,
+					epoch=None):
+		"""Record a finished request and grow the limits it used up unless
+		its throughput dropped
+		:type latency: float
+		:param latency: Duration of the request in seconds
+
+		:type size: int
+		:param size: Number of received bytes
+
+		:type batch_full: bool
+		:param batch_full: Request carried batch_size blocks
+
+		:type pipeline_full: bool
+		:param pipeline_full: Request was sent with in_flight requests
+			outstanding
+
+		:type epoch: int
+		:param epoch: Controller epoch the request was sent in, None
+			for the current one
+		"""
+		with self._lock:
+			self._consecutive_errors = 0
+			self.latency = self._smooth(self.latency, latency)
+			current = epoch is None or epoch >= self.epoch
+			# Partial batches are dominated by the request overhead
+			if batch_full and latency > 0:
+				throughput = size / latency
+				dropped = self.throughput is not None and \
+					throughput * self.spike_factor < self.throughput
+				self.throughput = self._smooth(self.throughput, throughput)
+				if not current:
+					return
+				if dropped:
+					self._decrease()
+					return
+				self.batch_size = min(self.batch_size + self.batch_step,
+										self.max_batch_size)
+			if current and pipeline_full:
+				# One more request in flight per window of successes
+				self._successes += 1
+				if self._successes >= self.in_flight:
+					self._successes = 0
+					self.in_flight = min(self.in_flight + 1,
+											self.max_in_flight)
+
+	def on_error(self, epoch=None):
+		"""Record a failed request and back off, once per epoch
+		:type epoch: int
+		:param epoch: Controller epoch the request was sent in, None
+			for the current one
+		"""
+		with self._lock:
+			self.errors += 1
+			self._consecutive_errors += 1
+			if epoch is None or epoch >= self.epoch:
+				self._decrease()
+
+	def retry_delay(self, retry_after=None):
+		"""Delay in seconds before retrying a failed request
+		:type retry_after: float
+		:param retry_after: Delay requested by the server, if any
+		"""
+		with self._lock:
+			delay = min(self.backoff
+						* 2 ** max(self._consecutive_errors - 1, 0),
+						self.max_backoff)
+		if retry_after is not None:
+			delay = max(delay, retry_after)
+		return delay
+
+	def _decrease(self):
+		self.epoch += 1
+		self.batch_size = max(self.batch_size // 2, 1)
+		self.in_flight = max(self.in_flight // 2, 1)
+		self._successes = 0
+
+	def _smooth(self, value, sample):
+		if value is None:
+			return sample
+		return (1 - self.smoothing) * value + self.smoothing * sample
+
+	@property
+	def limits(self):
+		"""Current limits and measurements for monitoring"""
+		with self._lock:
+			return {
+				"batchSize": self.batch_size,
+				"inFlight": self.in_flight,
+				"latency": self.latency,
+				"throughput": self.throughput,
+				"errors": self.errors,
+				"epoch": self.epoch
+			}
+
 class DatasetServerClient(object):
 
 	header="!lll"
 
 	binary_headers =  { "Content-Type": "application/octet-stream" }
 
+	# HTTP errors of an overloaded server, worth retrying
+	retry_statuses = (429, 502, 503, 504)
+
 	def __init__(self, base_url, regs_client):
 		#TODO: Use credentials from regs_client
 		self.base_url = base_url
@@ -23,6 +201,10 @@ class DatasetServerClient(object):
 		self.info = self.fetch_info()
 		self.voxel_type = None
 		self.block_fmt = None
+		# Sizes of the served resolution level, needed by read_plane()
+		self.dimensions = None
+		self.block_dimensions = None
+		self.io_controller = AdaptiveIOController()
 
 	def fetch_info(self):
 		result = requests.get(self.base_url)
@@ -125,56 +307,214 @@ class DatasetServerClient(object):
 		if self.block_fmt is None:
 			self.init_block_fmt()
 
-		count=0
-		blocks=len(block_coords_array)
 		results = {}
-		ids = []
+		for item, sizes, data in self._fetch_blocks(block_coords_array):
+			results[item] = (sizes,
+				struct.unpack("!%u%s" % (sizes.x * sizes.y * sizes.z, \
+									VOXEL_TYPES[self.voxel_type]), data))
+		return results
 
-		url = self.base_url
-		for idx in range(blocks):
-			item = block_coords_array[idx]
-			url2 = url + Block6D.to_ds_url_part(item) + '/'
-			if len(url2) < MAX_URL_LEN and idx != blocks - 1:
-				url = url2
-				ids += [item]
-				count = count+1
+
+	def read_plane(self, axis, index, time=0, channel=0, angle=0, rect=None):
+		"""Read a 2D plane of the served resolution level
+		:type axis: int or str
+		:param axis: Axis perpendicular to the plane, 0/'x' for YZ,
+			1/'y' for XZ and 2/'z' for XY planes
+
+		:type index: int
+		:param index: Position of the plane on the axis in voxels
+
+		:type rect: tuple
+		:param rect: (u, v, width, height) region of the plane in voxels,
+			where u and v are the two remaining axes in XYZ order.
+			None reads the whole plane
+
+		:rtype: numpy.ndarray
+		:return: Array of shape (height, width) with voxels of the region,
+			missing blocks and parts outside of the dataset are left zeroed
+		"""
+		if not self.can_read:
+			raise DataStoreAccessException(
+				"Collection opened from %s is not readable"
+				% self.regs_client.to_url())
+
+		if self.dimensions is None or self.block_dimensions is None:
+			raise DataStoreAccessException(
+				"Dimensions of collection opened from %s are not known"
+				% self.regs_client.to_url())
+
+		if self.block_fmt is None:
+			self.init_block_fmt()
+
+		n, u, v = plane_axes(axis)
+		dims = self.dimensions
+		bdims = self.block_dimensions
+		if rect is None:
+			rect = (0, 0, dims[u], dims[v])
+		u0, v0, width, height = rect
+		if width < 0 or height < 0:
+			raise ValueError("Invalid plane rect %s, width and height must "
+							 "not be negative" % str(rect))
+		u1 = min(u0 + width, dims[u])
+		v1 = min(v0 + height, dims[v])
+		# Parts of the rect before the dataset origin stay zeroed
+		first_u = max(u0, 0)
+		first_v = max(v0, 0)
+		import numpy as np # Needed only by viewers, keep it optional
+		plane = np.zeros((height, width), dtype=np.dtype(self.voxel_type))
+		if not 0 <= index < dims[n] or first_u >= u1 or first_v >= v1:
+			return plane
+
+		# Only the single block row/column crossing the plane is needed
+		block_coords_array = []
+		for bv in range(first_v // bdims[v], (v1 - 1) // bdims[v] + 1):
+			for bu in range(first_u // bdims[u], (u1 - 1) // bdims[u] + 1):
+				coords = [0, 0, 0]
+				coords[n] = index // bdims[n]
+				coords[u] = bu
+				coords[v] = bv
+				block_coords_array.append(
+					Block6D(*coords, time, channel, angle))
+
+		voxel_dtype = np.dtype(self.voxel_type).newbyteorder('>')
+		local_index = index % bdims[n]
+		for item, sizes, data in self._fetch_blocks(block_coords_array):
+			if local_index >= sizes[n]:
 				continue
-			else:
-				if idx != blocks - 1:
-					url2 = self.base_url + Block6D.to_ds_url_part(item)
-				else: # Last block has to be added to the URL
-					#TODO: We use shorter URLs, but could we get over
-					#      the maximum? Maybe rewrite with blocks+1 and
-					#      different ifs?
-					url = url2
-					ids += [item]
-					count = count+1
-				#print(url, count, str(ids))
-				result = requests.get(url[:-1])
-				if result is not None and int(result.status_code / 100) == 2:
-					all_data=result.content
-					start=0
-					for i in range(count):
-						hdr=all_data[start:start+12]
-						x,y,z = struct.unpack(DatasetServerClient.header, hdr)
-						total_size = x * y * z
-						expander="!%u%s" % (total_size, \
-										VOXEL_TYPES[self.voxel_type])
-						if total_size != -1:
-							typed_size = struct.calcsize(expander)
-							next_index = typed_size + start+12
-							results[ids[i]] = (Point3D(x, y, z),
-								 struct.unpack(expander, all_data[
-								   start+12:next_index]))
-							start = next_index
-						else:
-							start += 12
-				if idx != blocks - 1:
-					count = 1
-					url = url2
-					ids = [item]
-		return results
+			block = np.frombuffer(data, dtype=voxel_dtype) \
+						.reshape(sizes.z, sizes.y, sizes.x)
+			# Block arrays are indexed (z, y, x), planes are indexed (v, u)
+			block_plane = np.take(block, local_index, axis=2 - n)
+			ou = item[u] * bdims[u]
+			ov = item[v] * bdims[v]
+			su0, su1 = max(u0, ou), min(u1, ou + sizes[u])
+			sv0, sv1 = max(v0, ov), min(v1, ov + sizes[v])
+			if su0 >= su1 or sv0 >= sv1:
+				continue
+			plane[sv0 - v0:sv1 - v0, su0 - u0:su1 - u0] = \
+				block_plane[sv0 - ov:sv1 - ov, su0 - ou:su1 - ou]
+		return plane
 
+	@property
+	def io_limits(self):
+		"""Current block I/O limits chosen by the adaptive controller"""
+		return self.io_controller.limits
+
+	def _next_batch(self, pending):
+		"""Take blocks from pending for the next request, respecting both
+		the controller batch size and MAX_URL_LEN
+		:rtype: tuple
+		:return: URL and list of blocks requested by it
+		"""
+		url = self.base_url
+		ids = []
+		while pending and len(ids) < self.io_controller.batch_size:
+			part = Block6D.to_ds_url_part(pending[0]) + '/'
+			if ids and len(url) + len(part) >= MAX_URL_LEN:
+				self.io_controller.cap_batch_size(len(ids))
+				break
+			url += part
+			ids.append(pending.popleft())
+		return url[:-1], ids
+
+	def _timed_get(self, url):
+		start = monotonic()
+		result = requests.get(url, timeout=self.io_controller.request_timeout)
+		return result, monotonic() - start
+
+	@staticmethod
+	def _retry_after(result):
+		"""Seconds requested by the Retry-After header, None if missing"""
+		value = None if result is None else \
+				result.headers.get("Retry-After")
+		if value is None:
+			return None
+		try:
+			return max(float(value), 0)
+		except ValueError:
+			pass
+		try:
+			return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+		except (TypeError, ValueError):
+			return None
+
+	def _fetch_blocks(self, block_coords_array):
+		"""Request blocks in concurrent batches and split the answers
+		:rtype: generator
+		:return: tuples of block coordinates, ``Point3D`` with block sizes
+			and raw block data, missing blocks are skipped
+		"""
+		controller = self.io_controller
+		pending = deque(block_coords_array)
+		delayed = [] # (retry time, blocks) of failed requests
+		running = {}
+		attempts = {}
+		with ThreadPoolExecutor(max_workers=controller.max_in_flight) as pool:
+			while pending or running or delayed:
+				now = monotonic()
+				for entry in [d for d in delayed if d[0] <= now]:
+					delayed.remove(entry)
+					pending.extendleft(reversed(entry[1]))
+				while pending and len(running) < controller.in_flight:
+					url, ids = self._next_batch(pending)
+					running[pool.submit(self._timed_get, url)] = (ids,
+						len(ids) >= controller.batch_size,
+						len(running) + 1 >= controller.in_flight,
+						controller.epoch)
+				timeout = None
+				if delayed:
+					timeout = max(min(d[0] for d in delayed) - now, 0)
+				if not running:
+					sleep(timeout)
+					continue
+				done, _ = wait(running, timeout=timeout,
+								return_when=FIRST_COMPLETED)
+				for future in done:
+					ids, batch_full, pipeline_full, epoch = \
+						running.pop(future)
+					try:
+						result, latency = future.result()
+						error = None
+					except requests.RequestException as e:
+						result, error = None, e
+					if error is not None or result is None or \
+					  result.status_code in self.retry_statuses:
+						controller.on_error(epoch)
+						for item in ids:
+							attempts[item] = attempts.get(item, 0) + 1
+						if max(attempts[item] for item in ids) \
+						  > controller.max_retries:
+							if error is not None:
+								raise error
+							raise DataStoreAccessException(
+								"Blocks have not been read from %s%s"
+								% (self.base_url, "" if result is None else
+								   ", HTTP error %i" % result.status_code))
+						# Retried later with the reduced batch size
+						delayed.append((monotonic() + controller.retry_delay(
+							self._retry_after(result)), ids))
+						continue
+					if int(result.status_code / 100) != 2:
+						controller.on_error(epoch)
+						raise DataStoreAccessException(
+							"Blocks have not been read from %s, HTTP error %i"
+							% (self.base_url, result.status_code))
+					controller.on_success(latency, len(result.content),
+											batch_full, pipeline_full, epoch)
+					yield from self._split_blocks(result.content, ids)
+
+	def _split_blocks(self, all_data, ids):
+		start = 0
+		for item in ids:
+			x, y, z = struct.unpack(DatasetServerClient.header,
+									all_data[start:start+12])
+			start += 12
+			total_size = x * y * z
+			if total_size != -1:
+				next_index = start + struct.calcsize("!%u%s" \
+						% (total_size, VOXEL_TYPES[self.voxel_type]))
+				yield item, Point3D(x, y, z), all_data[start:next_index]
+				start = next_index
 
 	def write_block(self, block_coords, data, block_sizes):
 		"""Request a block from dataset server
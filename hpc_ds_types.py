@@ -70,6 +70,21 @@ def adjust_range(v, min_value=1, max_value=None, datatype=int):
 		v = datatype(v)
 	return v
 
+def plane_axes(axis):
+	"""Helper function returning axes of a 2D plane
+	:type axis: int or str
+	:param axis: Axis perpendicular to the plane, 0-2 or 'x', 'y', 'z'
+
+	:rtype: tuple
+	:return: Indices of the perpendicular axis and of the two plane axes
+	"""
+	if isinstance(axis, str):
+		axis = "xyz".find(axis.lower())
+	if axis not in (0, 1, 2):
+		raise ValueError("Invalid plane axis, use 0-2 or 'x', 'y', 'z'")
+	u, v = [a for a in range(3) if a != axis]
+	return axis, u, v
+
 # Points
 class Point3D(namedtuple('Point3D', ['x', 'y', 'z'])):
 
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+from types import SimpleNamespace
+from time import monotonic
+import struct
+
+import pytest
+
+import hpc_ds_dsclient
+from hpc_ds_client import HPCDatastoreClient
+from hpc_ds_desc import HPCDatastoreDescription
+from hpc_ds_dsclient import AdaptiveIOController, DatasetServerClient
+from hpc_ds_types import Block6D, Point3D, DataStoreAccessException
+
+BASE_URL = "http://localhost:9080/datasrv/"
+
+# uint16 volume numbering its voxels, edge blocks are smaller than
+# block dimensions
+DIMENSIONS = Point3D(17, 13, 10)
+BLOCK_DIMENSIONS = Point3D(4, 5, 3)
+BLOCKS = [Block6D(x, y, z, 0, 0, 0)
+		  for x in range(5) for y in range(3) for z in range(4)]
+
+def voxel(x, y, z):
+	return (z * DIMENSIONS.y + y) * DIMENSIONS.x + x
+
+def volume():
+	"""Volume as numpy array indexed (z, y, x), skips tests without numpy"""
+	np = pytest.importorskip("numpy")
+	return np.arange(DIMENSIONS.x * DIMENSIONS.y * DIMENSIONS.z,
+					 dtype=">u2").reshape(DIMENSIONS.z, DIMENSIONS.y,
+										 DIMENSIONS.x)
+
+
+class MockResponse(object):
+
+	def __init__(self, status_code=200, content=b"", json_data=None,
+					headers=None):
+		self.status_code = status_code
+		self.content = content
+		self.json_data = json_data
+		self.headers = headers or {}
+
+	def json(self):
+		return self.json_data
+
+
+class MockDatasetServer(object):
+	"""Serves blocks of the numbered volume the way dataset server does"""
+
+	def __init__(self):
+		self.urls = []
+		# Answers to the next block requests: a status, a (status, headers)
+		# tuple or None for a regular answer
+		self.failures = []
+
+	def get(self, url, timeout=None):
+		if url == BASE_URL:
+			return MockResponse(json_data={"mode": "READ",
+											"serverTimeout": -1})
+		self.urls.append(url)
+		failure = self.failures.pop(0) if self.failures else None
+		if isinstance(failure, int):
+			return MockResponse(status_code=failure)
+		if failure is not None:
+			return MockResponse(status_code=failure[0], headers=failure[1])
+		parts = [int(p) for p in url[len(BASE_URL):].split('/')]
+		content = b""
+		for i in range(0, len(parts), 6):
+			bx, by, bz = parts[i:i+3]
+			assert min(bx, by, bz) >= 0
+			ranges = [range(b * d, min((b + 1) * d, s)) for b, d, s
+					  in zip((bx, by, bz), BLOCK_DIMENSIONS, DIMENSIONS)]
+			if not all(ranges):
+				content += struct.pack("!lll", -1, -1, -1)
+				continue
+			xs, ys, zs = ranges
+			data = [voxel(x, y, z) for z in zs for y in ys for x in xs]
+			content += struct.pack("!lll%uH" % len(data),
+								   len(xs), len(ys), len(zs), *data)
+		return MockResponse(content=content)
+
+
+@pytest.fixture
+def server(monkeypatch):
+	server = MockDatasetServer()
+	monkeypatch.setattr(hpc_ds_dsclient.requests, "get", server.get)
+	return server
+
+
+@pytest.fixture
+def client(server):
+	regs_client = SimpleNamespace(expires=None, to_url=lambda: BASE_URL)
+	client = DatasetServerClient(BASE_URL, regs_client)
+	client.voxel_type = "uint16"
+	client.dimensions = DIMENSIONS
+	client.block_dimensions = BLOCK_DIMENSIONS
+	return client
+
+
+ALL = slice(None)
+
+@pytest.mark.parametrize("axis, index, expected", [
+	('z', 7, (7, ALL, ALL)),
+	('y', 12, (ALL, 12, ALL)),
+	('x', 16, (ALL, ALL, 16)),
+])
+def test_read_plane_full(client, server, axis, index, expected):
+	expected = volume()[expected]
+	plane = client.read_plane(axis, index)
+	assert plane.shape == expected.shape
+	assert (plane == expected).all()
+	assert len(server.urls) == 1
+
+
+@pytest.mark.parametrize("axis, index, expected", [
+	(2, 5, (5, slice(1, 9), slice(2, 11))),
+	(1, 6, (slice(1, 9), 6, slice(2, 11))),
+	(0, 3, (slice(1, 9), slice(2, 11), 3)),
+])
+def test_read_plane_rect(client, axis, index, expected):
+	expected = volume()[expected]
+	assert (client.read_plane(axis, index, rect=(2, 1, 9, 8)) == expected).all()
+
+
+def test_read_plane_clips_outside_dataset(client, server):
+	expected = volume()[9, 10:13, 0:4]
+	plane = client.read_plane('z', 9, rect=(-4, 10, 8, 8))
+	assert plane.shape == (8, 8)
+	assert (plane[:3, 4:] == expected).all()
+	assert not plane[:, :4].any() and not plane[3:, :].any()
+	assert not client.read_plane('z', 10).any()
+
+
+@pytest.mark.parametrize("rect", [(0, 0, -1, 4), (0, 0, 4, -4)])
+def test_read_plane_rejects_negative_rect(client, server, rect):
+	with pytest.raises(ValueError):
+		client.read_plane('z', 0, rect=rect)
+	assert not server.urls
+
+
+def test_read_blocks(client):
+	results = client.read_blocks(BLOCKS)
+	assert len(results) == len(BLOCKS)
+	sizes, data = results[Block6D(4, 2, 3, 0, 0, 0)]
+	assert sizes == Point3D(1, 3, 1)
+	assert data == tuple(voxel(16, y, 9) for y in range(10, 13))
+
+
+def test_read_blocks_retries_overloaded_server(client, server):
+	client.io_controller = AdaptiveIOController(batch_size=8, in_flight=4,
+												backoff=0.001)
+	server.failures = [503, 429]
+	assert len(client.read_blocks(BLOCKS)) == len(BLOCKS)
+	assert client.io_limits["errors"] == 2
+
+
+def test_read_blocks_burst_of_errors_backs_off_once(client, server):
+	# Throughput drops are disabled to keep the test independent of timing
+	client.io_controller = AdaptiveIOController(batch_size=4, in_flight=8,
+												max_retries=1, backoff=0.001,
+												spike_factor=1e9)
+	server.failures = [503, 429] * 4
+	assert len(client.read_blocks(BLOCKS)) == len(BLOCKS)
+	limits = client.io_limits
+	assert limits["errors"] == 8
+	assert limits["epoch"] == 1
+
+
+def test_read_blocks_retry_budget_per_block(client, server):
+	# Without backoff every failed batch is retried right after failing
+	client.io_controller = AdaptiveIOController(batch_size=4,
+		max_batch_size=4, in_flight=1, max_retries=1, backoff=0)
+	server.failures = [503, None, None] * 6
+	assert len(client.read_blocks(BLOCKS)) == len(BLOCKS)
+	assert client.io_limits["errors"] == 6
+
+
+def test_read_blocks_honours_retry_after(client, server):
+	client.io_controller = AdaptiveIOController(backoff=0.001)
+	server.failures = [(503, {"Retry-After": "0.2"})]
+	start = monotonic()
+	assert len(client.read_blocks(BLOCKS)) == len(BLOCKS)
+	assert monotonic() - start >= 0.2
+
+
+def test_read_blocks_raises_after_retries(client, server):
+	client.io_controller = AdaptiveIOController(max_retries=2, backoff=0.001)
+	server.failures = [503, 503, 503]
+	with pytest.raises(DataStoreAccessException):
+		client.read_blocks([Block6D(0, 0, 0, 0, 0, 0)])
+
+
+def test_read_blocks_reports_server_error(client, server):
+	server.failures = [500]
+	with pytest.raises(DataStoreAccessException, match="HTTP error 500"):
+		client.read_blocks(BLOCKS)
+	assert client.io_limits["errors"] == 1
+
+
+def test_batch_size_capped_by_url_length(client, server):
+	blocks = [Block6D(x, 0, 0, 0, 0, 0) for x in range(1000)]
+	client.read_blocks(blocks)
+	assert len(server.urls) > 1
+	longest = max(len(url.split('/')) for url in server.urls)
+	assert client.io_limits["batchSize"] <= (longest - 4) // 6 + 1
+
+
+def test_controller_grows_only_used_limits():
+	controller = AdaptiveIOController(batch_size=8, in_flight=2)
+	controller.on_success(0.1, 1000, False, False)
+	assert (controller.batch_size, controller.in_flight) == (8, 2)
+	for i in range(2):
+		controller.on_success(0.1, 1000, True, True)
+	assert (controller.batch_size, controller.in_flight) == (16, 3)
+
+
+def test_controller_backs_off_on_throughput_drop():
+	controller = AdaptiveIOController(batch_size=64, in_flight=8)
+	controller.on_success(0.1, 10000, True, False)
+	# Larger batch with proportionally longer latency is no overload
+	controller.on_success(0.2, 20000, True, False)
+	assert controller.batch_size == 72
+	controller.on_success(1.0, 20000, True, False)
+	assert (controller.batch_size, controller.in_flight) == (36, 4)
+
+
+def test_controller_ignores_stale_requests():
+	controller = AdaptiveIOController(batch_size=64, in_flight=8)
+	controller.on_error(0)
+	controller.on_error(0)
+	assert (controller.batch_size, controller.in_flight) == (32, 4)
+	controller.on_success(0.1, 1000, True, True, 0)
+	assert (controller.batch_size, controller.in_flight) == (32, 4)
+	controller.on_error(1)
+	assert (controller.batch_size, controller.in_flight) == (16, 2)
+
+
+def test_select_resolution_level():
+	desc = HPCDatastoreDescription(dimensions=Point3D(1024, 1024, 100),
+									resolution_levels=4)
+	assert desc.select_resolution_level((0, 1), (1024, 1024)) \
+			== Point3D(1, 1, 1)
+	assert desc.select_resolution_level((0, 1), (1024, 1024), (300, 300)) \
+			== Point3D(2, 2, 2)
+	assert desc.select_resolution_level((0, 1), (1024, 1024), (100, 100)) \
+			== Point3D(8, 8, 8)
+	assert desc.level_dimensions((4, 4, 4)) == Point3D(256, 256, 25)
+
+
+def test_client_read_plane_level_rect(monkeypatch):
+	calls = []
+	level_client = SimpleNamespace(
+		read_plane=lambda *args: calls.append(args))
+	ds_client = HPCDatastoreClient(dataset_path="dataset")
+	ds_client.ds_description = HPCDatastoreDescription(
+		dimensions=Point3D(64, 64, 64), resolution_levels=3)
+	monkeypatch.setattr(ds_client, "start_dataset_server",
+						lambda resolution, *args: level_client)
+	ds_client.read_plane('z', 13, rect=(3, 10, 10, 30), out_size=(2, 7))
+	# Full resolution x 3-12 and y 10-39 are covered at resolution 4
+	assert calls == [(2, 3, 0, 0, 0, (0, 2, 4, 8))]